@@ -1,51 +1,138 @@
 import cupy as cp
+import cupyx
 import numpy as np
 import time
 
 print("CuPy を使ったGPU計算の例")
 
-# 1. CPU (NumPy) でデータを準備
+# CPU で作ったデータを GPU に転送する流れも計測する場合は True にする
+# False の場合は GPU 上で直接データを生成し、CPU での生成と転送を省く
+BENCHMARK_TRANSFER = False
+
+# True の場合、FP32 の行列乗算を TF32 (Ampere 以降の Tensor コア) で計算する
+# 仮数部が 10 ビットになるため相対誤差は 1e-3 程度に増える
+# ICA の前処理など精度が必要な計算に使う場合は False にして FP32 のまま計算する
+USE_TF32 = True
+
+# True の場合、結果全体を CPU に戻して NumPy の計算結果と比較する
+# False の場合、結果は GPU 上に置いたままにし、確認用の数要素だけを CPU に戻す
+VALIDATE = False
+
 # 大きな配列を作成して、GPUでの計算のメリットを示す
 SIZE = 10000
-cpu_array_a = np.random.rand(SIZE, SIZE).astype(np.float32)
-cpu_array_b = np.random.rand(SIZE, SIZE).astype(np.float32)
-
-print(f"NumPy 配列の形状: {cpu_array_a.shape}")
-print("NumPy 配列 (A) の最初の数要素:\n", cpu_array_a[:2, :2])
-print("NumPy 配列 (B) の最初の数要素:\n", cpu_array_b[:2, :2])
-
-# 2. CuPy を使って GPU にデータを転送
-print("\nデータをGPUに転送中...")
-start_transfer = time.time()
-gpu_array_a = cp.array(cpu_array_a)
-gpu_array_b = cp.array(cpu_array_b)
-end_transfer = time.time()
-print(f"データ転送時間: {end_transfer - start_transfer:.4f} 秒")
-
-# 3. GPU (CuPy) で計算を実行
-print("GPUで計算を実行中 (行列乗算)...")
-start_gpu_calc = time.time()
-gpu_result = gpu_array_a @ gpu_array_b # 行列乗算
-# または gpu_result = cp.matmul(gpu_array_a, gpu_array_b)
-end_gpu_calc = time.time()
-print(f"GPU計算時間: {end_gpu_calc - start_gpu_calc:.4f} 秒")
-
-# 4. 結果を GPU から CPU に戻す (必要であれば)
-print("\n結果をCPUに戻し中...")
-start_get = time.time()
-cpu_result = gpu_result.get() # .get() メソッドで GPU から CPU にデータを取得
-end_get = time.time()
-print(f"結果取得時間: {end_get - start_get:.4f} 秒")
-
-print("\nGPU計算結果 (CPU上のNumPy配列として) の最初の数要素:\n", cpu_result[:2, :2])
-
-# 参考: CPU (NumPy) で同じ計算を行った場合の時間比較
-print("\n参考: CPU (NumPy) で同じ計算を実行中...")
-start_cpu_calc = time.time()
-cpu_true_result = cpu_array_a @ cpu_array_b
-end_cpu_calc = time.time()
-print(f"CPU計算時間: {end_cpu_calc - start_cpu_calc:.4f} 秒")
-
-# 結果の検証 (オプション)
-# GPUとCPUの結果が一致するか確認
-# print("\n結果の最大絶対誤差:", np.max(np.abs(cpu_result - cpu_true_result)))
\ No newline at end of file
+NUM_STREAMS = 3
+streams = [cp.cuda.Stream(non_blocking=True) for _ in range(NUM_STREAMS)]
+
+if USE_TF32:
+    # cuBLAS ハンドルの演算モードを変えるだけなので、配列は FP32 のまま扱える
+    cp.cuda.cublas.setMathMode(cp.cuda.device.get_cublas_handle(),
+                               cp.cuda.cublas.CUBLAS_TF32_TENSOR_OP_MATH)
+
+if BENCHMARK_TRANSFER:
+    # 1. CPU (NumPy) でデータを準備
+    # ページロック (pinned) メモリに確保しておくと、GPU への転送が DMA で直接行われる
+    cpu_array_a = cupyx.empty_pinned((SIZE, SIZE), dtype=np.float32)
+    cpu_array_b = cupyx.empty_pinned((SIZE, SIZE), dtype=np.float32)
+    cpu_array_a[...] = np.random.rand(SIZE, SIZE)
+    cpu_array_b[...] = np.random.rand(SIZE, SIZE)
+
+    print(f"NumPy 配列の形状: {cpu_array_a.shape}")
+    print("NumPy 配列 (A) の最初の数要素:\n", cpu_array_a[:2, :2])
+    print("NumPy 配列 (B) の最初の数要素:\n", cpu_array_b[:2, :2])
+
+    # 2. CuPy を使って GPU にデータを転送
+    # B はすべてのタイルの計算で共有するので、一度だけ転送して GPU 上に置いておく
+    print("\nデータをGPUに転送中...")
+    start_transfer = time.time()
+    with streams[0]:
+        # cp.array / cp.asarray は転送元が pinned メモリでも内部で別の pinned バッファに
+        # コピーしてから転送するため、GPU 側を確保して set() で直接転送する
+        gpu_array_b = cp.empty(cpu_array_b.shape, dtype=cpu_array_b.dtype)
+        gpu_array_b.set(cpu_array_b, stream=streams[0])
+    streams[0].synchronize()
+    end_transfer = time.time()
+    print(f"データ転送時間 (B): {end_transfer - start_transfer:.4f} 秒")
+
+    # 3. A を行方向のタイルに分け、ストリームごとに 転送 -> 計算 -> 取得 を発行する
+    # ストリーム間の処理は非同期なので、あるタイルの転送と別のタイルの計算が重なる
+    print(f"GPUで計算を実行中 (行列乗算, {NUM_STREAMS} ストリーム)...")
+    cpu_result = cupyx.empty_pinned((SIZE, SIZE), dtype=np.float32)
+    # pinned 配列の連続した行ブロックはそのまま非同期転送に使える
+    a_tiles = np.array_split(cpu_array_a, NUM_STREAMS)
+    result_tiles = np.array_split(cpu_result, NUM_STREAMS)
+    # 非同期の転送が終わるまで GPU 側のタイルを解放しないよう、参照を保持しておく
+    gpu_tiles = []
+    start_gpu_calc = time.time()
+    for stream, a_tile, result_tile in zip(streams, a_tiles, result_tiles):
+        with stream:
+            gpu_a_tile = cp.empty(a_tile.shape, dtype=a_tile.dtype)
+            gpu_a_tile.set(a_tile, stream=stream)
+            gpu_result_tile = gpu_a_tile @ gpu_array_b # 行列乗算
+            # または gpu_result_tile = cp.matmul(gpu_a_tile, gpu_array_b)
+            # .get() は既定でストリームの完了を待つため、blocking=False で取得を発行するだけにする
+            gpu_result_tile.get(stream=stream, out=result_tile, blocking=False)
+        gpu_tiles.append((gpu_a_tile, gpu_result_tile))
+    # すべてのストリームの処理が終わるのをここでまとめて待つ
+    cp.cuda.Device().synchronize()
+    end_gpu_calc = time.time()
+    print(f"GPU計算時間 (A の転送と結果取得を含む): {end_gpu_calc - start_gpu_calc:.4f} 秒")
+
+    print("\nGPU計算結果 (CPU上のNumPy配列として) の最初の数要素:\n", cpu_result[:2, :2])
+else:
+    # 1. GPU (CuPy) 上で直接データを生成
+    # 乱数データなので CPU で作って転送する必要はない
+    stream = streams[0]
+    with stream:
+        gpu_array_a = cp.random.rand(SIZE, SIZE, dtype=cp.float32)
+        gpu_array_b = cp.random.rand(SIZE, SIZE, dtype=cp.float32)
+    stream.synchronize()
+
+    print(f"CuPy 配列の形状: {gpu_array_a.shape}")
+
+    # 2. GPU (CuPy) で計算を実行
+    # 行列乗算はカーネルをキューに積むだけで戻るので、time.time() ではなく
+    # ストリーム上に記録した CUDA イベント間の時間で計測する
+    print("GPUで計算を実行中 (行列乗算)...")
+    start_gpu_calc = cp.cuda.Event()
+    end_gpu_calc = cp.cuda.Event()
+    with stream:
+        start_gpu_calc.record()
+        gpu_result = gpu_array_a @ gpu_array_b # 行列乗算
+        # または gpu_result = cp.matmul(gpu_array_a, gpu_array_b)
+        end_gpu_calc.record()
+    end_gpu_calc.synchronize()
+    gpu_calc_ms = cp.cuda.get_elapsed_time(start_gpu_calc, end_gpu_calc)
+    print(f"GPU計算時間: {gpu_calc_ms:.2f} ミリ秒")
+
+    # 3. 結果は GPU 上に置いたまま、確認用に最初の数要素だけを CPU に戻す
+    # (400MB 全体ではなく 16 バイトの転送で済む)
+    print("\nGPU計算結果の最初の数要素:\n", gpu_result[:2, :2].get(stream=stream))
+
+    if VALIDATE:
+        # 4. 検証のために結果全体を GPU から CPU に戻す
+        print("\n結果をCPUに戻し中...")
+        cpu_result = cupyx.empty_pinned((SIZE, SIZE), dtype=np.float32)
+        start_get = cp.cuda.Event()
+        end_get = cp.cuda.Event()
+        start_get.record(stream)
+        gpu_result.get(stream=stream, out=cpu_result) # .get() メソッドで GPU から CPU にデータを取得
+        end_get.record(stream)
+        end_get.synchronize()
+        get_ms = cp.cuda.get_elapsed_time(start_get, end_get)
+        print(f"結果取得時間: {get_ms:.2f} ミリ秒")
+
+        # 参考計算用に入力も CPU に戻しておく (計測の対象外)
+        cpu_array_a = gpu_array_a.get()
+        cpu_array_b = gpu_array_b.get()
+
+if VALIDATE:
+    # 参考: CPU (NumPy) で同じ計算を行った場合の時間比較
+    print("\n参考: CPU (NumPy) で同じ計算を実行中...")
+    start_cpu_calc = time.time()
+    cpu_true_result = cpu_array_a @ cpu_array_b
+    end_cpu_calc = time.time()
+    print(f"CPU計算時間: {end_cpu_calc - start_cpu_calc:.4f} 秒")
+
+    # 結果の検証
+    # GPUとCPUの結果が一致するか確認
+    print("\n結果の最大絶対誤差:", np.max(np.abs(cpu_result - cpu_true_result)))
\ No newline at end of file
@@ -1,10 +1,22 @@
 import os
 import csv
+import codecs
+import io
 from pathlib import Path
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 import re
 
+# ファイル名から日付・時刻を取り出す正規表現（呼び出しごとの再コンパイルを避ける）
+_DATE_RE = re.compile(r'(\d{8})')
+_TRIM_RE = re.compile(r'(\d{8})-(\d{6})-(\d+)\.npy')
+
+# CSV読み込み時のバッファサイズ（大きなCSVでの読み込み回数を減らす）
+_CSV_BUFFER_SIZE = 1 << 20
+# 文字コード判定のために読み込むCSV先頭のバイト数
+_ENCODING_PROBE_SIZE = 4096
+
 def parse_trim_image_time(filename):
     """
     trim_imageファイル名から時刻を解析する
@@ -16,16 +28,16 @@ def parse_trim_image_time(filename):
         tuple: (datetime, milliseconds) 解析された時刻とミリ秒
     """
     # ファイル名から日付と時刻を抽出 (例: 20241213-073154-781.npy)
-    match = re.match(r'(\d{8})-(\d{6})-(\d+)\.npy', filename)
+    match = _TRIM_RE.match(filename)
     if match:
         date_str = match.group(1)
         time_str = match.group(2)
         milliseconds = int(match.group(3))
-        # 日付と時刻を結合してdatetimeオブジェクトを作成
-        datetime_str = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:8]} {time_str[:2]}:{time_str[2:4]}:{time_str[4:6]}"
-        base_time = datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S")
-        # ミリ秒をマイクロ秒に変換して追加
-        time_with_ms = base_time.replace(microsecond=milliseconds * 1000)
+        # 固定桁の日付と時刻を直接整数に変換してdatetimeオブジェクトを作成（strptimeより高速）
+        # ミリ秒はマイクロ秒に変換して設定
+        time_with_ms = datetime(int(date_str[:4]), int(date_str[4:6]), int(date_str[6:8]),
+                                int(time_str[:2]), int(time_str[2:4]), int(time_str[4:6]),
+                                milliseconds * 1000)
         return (time_with_ms, milliseconds)
     return None
 
@@ -39,15 +51,104 @@ def parse_csv_time(time_str):
     Returns:
         datetime: 解析された時刻
     """
+    # 時刻文字列を区切り文字で分割して解析 (例: 2024/12/13 7:31)
+    # 時や日はゼロ埋めされないことがあるため、固定位置ではなく分割で取り出す（strptimeより高速）
+    date_part, _, time_part = time_str.strip().partition(' ')
+    date_fields = date_part.split('/')
+    time_fields = time_part.split(':')
+    # 秒が含まれている場合 (例: 2024/12/13 7:31:00) も受け付ける
+    if len(date_fields) != 3 or len(time_fields) not in (2, 3):
+        return None
     try:
-        # 時刻文字列を解析 (例: 2024/12/13 7:31)
-        return datetime.strptime(time_str.strip(), "%Y/%m/%d %H:%M")
+        return datetime(*map(int, date_fields), *map(int, time_fields))
     except ValueError:
+        return None
+
+def parse_csv_times(time_strs):
+    """
+    CSVの1列目の時刻文字列をまとめて解析する
+    
+    Args:
+        time_strs (list): 時刻文字列のリスト
+    
+    Returns:
+        list: 解析できた時刻 (datetime) のリスト（解析できない値は除く）
+    """
+    # 1セット2行で同じ分の時刻が続くため、同じ文字列は一度だけ解析する
+    parsed = {}
+    csv_times = []
+    for time_str in time_strs:
+        csv_time = parsed.get(time_str)
+        if csv_time is None and time_str not in parsed:
+            csv_time = parsed[time_str] = parse_csv_time(time_str)
+        if csv_time:
+            csv_times.append(csv_time)
+    return csv_times
+
+def _open_csv(path, encoding=None):
+    """
+    CSVファイルの文字コードを先頭部分から判定して開く
+    
+    Args:
+        path (str): CSVファイルのパス
+        encoding (str): 文字コード（指定した場合は判定しない）
+    
+    Returns:
+        file object: csv.reader にそのまま渡せるテキストファイル
+    """
+    if encoding is not None:
+        return open(path, 'r', encoding=encoding, newline='', buffering=_CSV_BUFFER_SIZE)
+    # 先頭だけを読んで判定し、UTF-8で失敗してからShift-JISで全体を読み直すことを避ける
+    with open(path, 'rb') as f:
+        head = f.read(_ENCODING_PROBE_SIZE)
+    if head.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    else:
         try:
-            # 秒が含まれている場合 (例: 2024/12/13 7:31:00)
-            return datetime.strptime(time_str.strip(), "%Y/%m/%d %H:%M:%S")
-        except ValueError:
-            return None
+            # 末尾で途切れたマルチバイト文字はエラーにしない
+            codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+            encoding = 'utf-8'
+        except UnicodeDecodeError:
+            encoding = 'shift_jis'
+    return open(path, 'r', encoding=encoding, newline='', buffering=_CSV_BUFFER_SIZE)
+
+@lru_cache(maxsize=64)
+def _load_csv_rows(path, mtime):
+    """
+    CSVファイルのヘッダー以外の行を読み込む（同じファイルの再読み込みを避けるためキャッシュする）
+    
+    Args:
+        path (str): CSVファイルのパス
+        mtime (float): ファイルの更新時刻（ファイルが更新された場合にキャッシュを無効にするためのキー）
+    
+    Returns:
+        tuple: 各行を文字列のタプルにしたタプル
+    """
+    with _open_csv(path) as f:
+        encoding = f.encoding
+        try:
+            return _read_csv_rows(f)
+        except UnicodeDecodeError:
+            if encoding == 'shift_jis':
+                raise
+    # 先頭部分がASCIIのみのShift-JISファイルはUTF-8と判定されるため、Shift-JISで読み直す
+    with _open_csv(path, encoding='shift_jis') as f:
+        return _read_csv_rows(f)
+
+def _read_csv_rows(f):
+    """
+    開いたCSVファイルからヘッダー以外の行を読み込む
+    
+    Args:
+        f (file object): _open_csv で開いたCSVファイル
+    
+    Returns:
+        tuple: 各行を文字列のタプルにしたタプル
+    """
+    reader = csv.reader(f)
+    next(reader)  # ヘッダー行をスキップ
+    # キャッシュした内容が書き換えられないよう、タプルで返す
+    return tuple(tuple(row) for row in reader)
 
 def check_trim_image_csv_timing(trim_base_dir, csv_base_dir, time_diff_threshold=300, trim_interval_threshold=1, csv_match_required=True):
     """
@@ -79,11 +180,9 @@ def check_trim_image_csv_timing(trim_base_dir, csv_base_dir, time_diff_threshold
         return
     
     # trim_imageディレクトリから日付ディレクトリを検索（8桁の数字のディレクトリ）
-    trim_date_directories = []
-    for item in os.listdir(trim_base_dir):
-        item_path = os.path.join(trim_base_dir, item)
-        if os.path.isdir(item_path) and item.isdigit() and len(item) == 8:
-            trim_date_directories.append(item)
+    with os.scandir(trim_base_dir) as entries:
+        trim_date_directories = [entry.name for entry in entries
+                                 if entry.is_dir() and entry.name.isdigit() and len(entry.name) == 8]
     
     if not trim_date_directories:
         print(f"ディレクトリ '{trim_base_dir}' に8桁の日付ディレクトリが見つかりません。")
@@ -91,16 +190,17 @@ def check_trim_image_csv_timing(trim_base_dir, csv_base_dir, time_diff_threshold
     
     # CSVディレクトリからCSVファイルを検索し、ファイル名から8桁の日付を抽出
     csv_date_files = {}
-    for item in os.listdir(csv_base_dir):
-        item_path = os.path.join(csv_base_dir, item)
-        if os.path.isfile(item_path) and item.lower().endswith('.csv'):
-            # CSVファイル名から8桁の数字を抽出
-            date_match = re.search(r'(\d{8})', item)
-            if date_match:
-                date_str = date_match.group(1)
-                if date_str not in csv_date_files:
-                    csv_date_files[date_str] = []
-                csv_date_files[date_str].append(item)
+    with os.scandir(csv_base_dir) as entries:
+        csv_file_names = [entry.name for entry in entries
+                          if entry.name.lower().endswith('.csv') and entry.is_file()]
+    for item in csv_file_names:
+        # CSVファイル名から8桁の数字を抽出
+        date_match = _DATE_RE.search(item)
+        if date_match:
+            date_str = date_match.group(1)
+            if date_str not in csv_date_files:
+                csv_date_files[date_str] = []
+            csv_date_files[date_str].append(item)
     
     if not csv_date_files:
         print(f"ディレクトリ '{csv_base_dir}' に日付を含むCSVファイルが見つかりません。")
@@ -120,71 +220,68 @@ def check_trim_image_csv_timing(trim_base_dir, csv_base_dir, time_diff_threshold
     
     total_trim_images = 0
     total_csv_lines = 0
-    date_summary = defaultdict(dict)
+    date_summary = {}
     
-    # 各共通日付ディレクトリを処理
-    for date_dir in common_dates:
-        print(f"=== {date_dir} ===")
+    def process_date(date_dir):
+        """
+        1つの日付ディレクトリについてtrim_imageとCSVの時刻を比較する
+        
+        Args:
+            date_dir (str): 8桁の日付ディレクトリ名
+        
+        Returns:
+            tuple: (表示するテキスト, サマリー辞書) 処理できなかった場合のサマリーはNone
+        """
+        # 並列実行中に出力が混ざらないよう、表示内容はバッファにためて返す
+        out = io.StringIO()
+        print(f"=== {date_dir} ===", file=out)
         
         # trim_imageのパス
         trim_date_path = os.path.join(trim_base_dir, date_dir, "affine_data")
         
         if not os.path.exists(trim_date_path):
-            print("  trim_image affine_dataフォルダが見つかりません")
-            continue
+            print("  trim_image affine_dataフォルダが見つかりません", file=out)
+            return out.getvalue(), None
         
         # affine_data内のtrim_imageディレクトリを検索
         trim_image_path = os.path.join(trim_date_path, "trim_image")
         
         if not os.path.exists(trim_image_path):
-            print("  trim_imageディレクトリが見つかりません")
-            continue
+            print("  trim_imageディレクトリが見つかりません", file=out)
+            return out.getvalue(), None
         
         if not os.path.isdir(trim_image_path):
-            print("  trim_imageはディレクトリではありません")
-            continue
+            print("  trim_imageはディレクトリではありません", file=out)
+            return out.getvalue(), None
         
         # trim_imageディレクトリ内のnpyファイルを取得
         try:
-            trim_files = [f for f in os.listdir(trim_image_path) if f.endswith('.npy') and os.path.isfile(os.path.join(trim_image_path, f))]
+            with os.scandir(trim_image_path) as entries:
+                # 拡張子を先に判定し、npy以外のエントリでは種別の確認自体を省く
+                trim_files = [entry.name for entry in entries if entry.name.endswith('.npy') and entry.is_file()]
             trim_count = len(trim_files)
         except Exception as e:
-            print(f"  trim_imageディレクトリの読み込みエラー: {e}")
-            continue
+            print(f"  trim_imageディレクトリの読み込みエラー: {e}", file=out)
+            return out.getvalue(), None
         
         # 該当日付のCSVファイルを取得
         csv_files = csv_date_files.get(date_dir, [])
         
         if not csv_files:
-            print(f"  日付 {date_dir} に対応するCSVファイルが見つかりません")
-            continue
+            print(f"  日付 {date_dir} に対応するCSVファイルが見つかりません", file=out)
+            return out.getvalue(), None
         
         # CSVファイルの1列目から時刻を読み込み
         csv_path = os.path.join(csv_base_dir, csv_files[0])
-        csv_times = []
-        
+        # 行データはセット内の行一致チェックでも使うため、ここで一度だけ読み込んでおく
         try:
-            with open(csv_path, 'r', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                next(reader)  # ヘッダー行をスキップ
-                for row in reader:
-                    if row and len(row) > 0 and row[0].strip():  # 1列目が存在し、空でない場合
-                        csv_time = parse_csv_time(row[0])
-                        if csv_time:
-                            csv_times.append(csv_time)
-        except UnicodeDecodeError:
-            try:
-                with open(csv_path, 'r', encoding='shift_jis') as f:
-                    reader = csv.reader(f)
-                    next(reader)  # ヘッダー行をスキップ
-                    for row in reader:
-                        if row and len(row) > 0 and row[0].strip():  # 1列目が存在し、空でない場合
-                            csv_time = parse_csv_time(row[0])
-                            if csv_time:
-                                csv_times.append(csv_time)
-            except Exception as e:
-                print(f"  CSVファイルの読み込みエラー: {e}")
-                continue
+            csv_rows = _load_csv_rows(csv_path, os.path.getmtime(csv_path))
+        except Exception as e:
+            print(f"  CSVファイルの読み込みエラー: {e}", file=out)
+            return out.getvalue(), None
+        
+        # 1列目が存在し、空でない行の時刻をまとめて解析
+        csv_times = parse_csv_times([row[0] for row in csv_rows if row and row[0].strip()])
         
         # trim_imageファイルの時刻を解析
         trim_times = []
@@ -199,37 +296,35 @@ def check_trim_image_csv_timing(trim_base_dir, csv_base_dir, time_diff_threshold
         csv_times.sort()
         
         # パス情報を表示
-        print(f"  trim_imageディレクトリ: {trim_image_path}")
-        print(f"  CSVファイル: {csv_path}")
-        print(f"  trim_image: {len(trim_times)} ファイル")
-        print(f"  CSV1列目: {len(csv_times)} 行")
+        print(f"  trim_imageディレクトリ: {trim_image_path}", file=out)
+        print(f"  CSVファイル: {csv_path}", file=out)
+        print(f"  trim_image: {len(trim_times)} ファイル", file=out)
+        print(f"  CSV1列目: {len(csv_times)} 行", file=out)
+        
+        # 警告チェック用のリスト
+        warnings = []
         
         # 一対一対応と時刻差を測定
         if len(trim_times) == len(csv_times):
-            print(f"  一対一対応: ✓ 一致")
-            print(f"  時刻差の詳細:")
+            print(f"  一対一対応: ✓ 一致", file=out)
+            print(f"  時刻差の詳細:", file=out)
             
-            total_time_diff = 0
-            max_time_diff = 0
-            min_time_diff = float('inf')
+            # trim_imageとCSVの時刻差をまとめて計算し、統計は組み込み関数で一度に集計する
+            time_diffs = [abs((trim_time - csv_time).total_seconds())
+                          for (_, trim_time, _), csv_time in zip(trim_times, csv_times)]
+            total_time_diff = sum(time_diffs)
+            max_time_diff = max(time_diffs, default=0)
+            min_time_diff = min(time_diffs, default=float('inf'))
             
             # セット内の時間差を計算
             set_time_diffs = []
             
-            # 警告チェック用のリスト
-            warnings = []
-            
-            for i, ((trim_file, trim_time, milliseconds), csv_time) in enumerate(zip(trim_times, csv_times)):
-                time_diff = abs((trim_time - csv_time).total_seconds())
-                total_time_diff += time_diff
-                max_time_diff = max(max_time_diff, time_diff)
-                min_time_diff = min(min_time_diff, time_diff)
-                
+            for i, ((trim_file, trim_time, milliseconds), csv_time, time_diff) in enumerate(zip(trim_times, csv_times, time_diffs)):
                 # 時刻差の警告チェック
                 if time_diff >= time_diff_threshold:
                     warnings.append(f"    時刻差警告: {trim_file} - CSV時刻差 {time_diff:.1f}秒 >= {time_diff_threshold}秒")
                 
-                print(f"    {i+1:3d}: {trim_file} ({trim_time.strftime('%H:%M:%S.%f')[:-3]}) - CSV ({csv_time.strftime('%H:%M:%S')}) = {time_diff:6.1f}秒")
+                print(f"    {i+1:3d}: {trim_file} ({trim_time.strftime('%H:%M:%S.%f')[:-3]}) - CSV ({csv_time.strftime('%H:%M:%S')}) = {time_diff:6.1f}秒", file=out)
                 
                 # 奇数番目と偶数番目のセット内時間差を計算
                 if i % 2 == 1:  # 偶数番目（インデックス1, 3, 5...）
@@ -241,20 +336,12 @@ def check_trim_image_csv_timing(trim_base_dir, csv_base_dir, time_diff_threshold
                         set_trim_diff = abs((trim_time - prev_trim_time).total_seconds())
                         
                         # CSVの行データが一致しているかチェック
-                        csv_path = os.path.join(csv_base_dir, csv_files[0])
                         csv_row_match = False
-                        try:
-                            with open(csv_path, 'r', encoding='utf-8') as f:
-                                reader = csv.reader(f)
-                                next(reader)  # ヘッダー行をスキップ
-                                rows = list(reader)
-                                if i < len(rows) and i-1 < len(rows):
-                                    # 奇数番目と偶数番目の行データを比較
-                                    prev_row = rows[i-1]
-                                    curr_row = rows[i]
-                                    csv_row_match = prev_row == curr_row
-                        except:
-                            pass
+                        if i < len(csv_rows) and i-1 < len(csv_rows):
+                            # 奇数番目と偶数番目の行データを比較
+                            prev_row = csv_rows[i-1]
+                            curr_row = csv_rows[i]
+                            csv_row_match = prev_row == curr_row
                         
                         # 警告チェック
                         if set_trim_diff >= trim_interval_threshold:
@@ -273,60 +360,65 @@ def check_trim_image_csv_timing(trim_base_dir, csv_base_dir, time_diff_threshold
             
             # セット内時間差の統計を表示
             if set_time_diffs:
-                print(f"\n  セット内時間差の詳細:")
-                total_set_diff = 0
-                max_set_diff = 0
-                min_set_diff = float('inf')
-                csv_match_count = 0
-                
+                print(f"\n  セット内時間差の詳細:", file=out)
                 for set_info in set_time_diffs:
                     match_status = "✓ 一致" if set_info['csv_match'] else "✗ 不一致"
-                    print(f"    セット {set_info['set_number']:2d}: trim_image間隔 {set_info['trim_diff']:6.1f}秒, CSV行一致: {match_status}")
-                    print(f"             前: {set_info['trim_file_prev']}")
-                    print(f"             後: {set_info['trim_file_curr']}")
-                    
-                    total_set_diff += set_info['trim_diff']
-                    max_set_diff = max(max_set_diff, set_info['trim_diff'])
-                    min_set_diff = min(min_set_diff, set_info['trim_diff'])
-                    if set_info['csv_match']:
-                        csv_match_count += 1
+                    print(f"    セット {set_info['set_number']:2d}: trim_image間隔 {set_info['trim_diff']:6.1f}秒, CSV行一致: {match_status}", file=out)
+                    print(f"             前: {set_info['trim_file_prev']}", file=out)
+                    print(f"             後: {set_info['trim_file_curr']}", file=out)
+                
+                set_diffs = [set_info['trim_diff'] for set_info in set_time_diffs]
+                total_set_diff = sum(set_diffs)
+                max_set_diff = max(set_diffs)
+                min_set_diff = min(set_diffs)
+                csv_match_count = sum(1 for set_info in set_time_diffs if set_info['csv_match'])
                 
                 avg_set_diff = total_set_diff / len(set_time_diffs) if set_time_diffs else 0
-                print(f"  セット内時間差統計:")
-                print(f"    平均: {avg_set_diff:.1f}秒")
-                print(f"    最大: {max_set_diff:.1f}秒")
-                print(f"    最小: {min_set_diff:.1f}秒")
-                print(f"    CSV行一致率: {csv_match_count}/{len(set_time_diffs)} ({csv_match_count/len(set_time_diffs)*100:.1f}%)")
+                print(f"  セット内時間差統計:", file=out)
+                print(f"    平均: {avg_set_diff:.1f}秒", file=out)
+                print(f"    最大: {max_set_diff:.1f}秒", file=out)
+                print(f"    最小: {min_set_diff:.1f}秒", file=out)
+                print(f"    CSV行一致率: {csv_match_count}/{len(set_time_diffs)} ({csv_match_count/len(set_time_diffs)*100:.1f}%)", file=out)
             
             # 警告メッセージを表示
             if warnings:
-                print(f"\n  ⚠️  警告メッセージ:")
+                print(f"\n  ⚠️  警告メッセージ:", file=out)
                 for warning in warnings:
-                    print(warning)
+                    print(warning, file=out)
             else:
-                print(f"\n  ✓ 警告なし")
+                print(f"\n  ✓ 警告なし", file=out)
             
             avg_time_diff = total_time_diff / len(trim_times) if trim_times else 0
-            print(f"\n  全体時刻差統計:")
-            print(f"    平均: {avg_time_diff:.1f}秒")
-            print(f"    最大: {max_time_diff:.1f}秒")
-            print(f"    最小: {min_time_diff:.1f}秒")
+            print(f"\n  全体時刻差統計:", file=out)
+            print(f"    平均: {avg_time_diff:.1f}秒", file=out)
+            print(f"    最大: {max_time_diff:.1f}秒", file=out)
+            print(f"    最小: {min_time_diff:.1f}秒", file=out)
             
             status = "✓ 時刻対応完了"
         else:
-            print(f"  一対一対応: ✗ 不一致 (trim_image: {len(trim_times)}, CSV: {len(csv_times)})")
+            print(f"  一対一対応: ✗ 不一致 (trim_image: {len(trim_times)}, CSV: {len(csv_times)})", file=out)
             status = "✗ 時刻対応失敗"
         
-        total_trim_images += len(trim_times)
-        total_csv_lines += len(csv_times)
-        
-        date_summary[date_dir] = {
+        summary = {
             'trim_images': len(trim_times),
             'csv_lines': len(csv_times),
             'consistent': len(trim_times) == len(csv_times),
             'warnings': warnings
         }
-        print()
+        print(file=out)
+        return out.getvalue(), summary
+    
+    # 各日付ディレクトリは独立しているため並列に処理し、出力は日付順に表示する
+    with ThreadPoolExecutor(max_workers=min(8, len(common_dates))) as executor:
+        results = list(executor.map(process_date, common_dates))
+    
+    for date_dir, (output, summary) in zip(common_dates, results):
+        print(output, end='')
+        if summary is None:
+            continue
+        total_trim_images += summary['trim_images']
+        total_csv_lines += summary['csv_lines']
+        date_summary[date_dir] = summary
     
     # 全体のサマリーを表示
     print("=" * 80)